@@ -1,16 +1,29 @@
 import os
-import subprocess
+import re
+import copy
+import stat
 import sqlite3
-import datetime
+import time
 import asyncio
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional
 
 import flask
-import pandas as pd
+import numpy as np
 
 import dash
-from dash.dependencies import Input, Output  # , State
-from dash import dcc, html, dash_table
+from dash.dependencies import Input, Output, State
+from dash import dcc, html, dash_table, ctx, Patch
 import plotly.graph_objs as go
+import plotly.io.json
+
+# コールバックの返り値のJSON化にorjsonを使う
+# numpy配列をPythonのリストに変換せずにそのままエンコードできる
+plotly.io.json.config.default_engine = "orjson"
+
+log = logging.getLogger(__name__)
 
 TITLE = "Disk Usage Monitor"
 DESCRIPTION = "\\\\ns5のディスク容量を可視化します。"
@@ -19,133 +32,398 @@ DB_NAME = "disk_usage.db"
 INTERVAL_SEC = 10
 """
 LIMIT_ROWについて
-    10秒ごとにdf取得
+    10秒ごとにディスク容量を取得
     *360 件 == 1H
     *24 = 8640件 == 1day
     *365 = 3_153_600件 == 1year
 """
 LIMIT_ROW = 8640
+# グラフに表示する件数
+MAX_POINT = 100
+# 表示範囲より古いデータはこの件数まで間引いて送る
+# (ズームアウト、パンしたときに1日分を見られるように)
+DOWNSAMPLE_POINT = 500
+# Asia/Tokyo location
+JST_OFFSET_SEC = 9 * 3600
+# BATCH_ROW件溜まったら1トランザクションでまとめてINSERTする
+# グラフはメモリ上のRINGから読み込むので、DBへの書き込みは遅れてもよい
+BATCH_ROW = 6
+
+# DBの接続 db_init()で開いてプロセス終了まで使い回す
+_conn: sqlite3.Connection = None
+# 文字列を固定してsqlite3のステートメントキャッシュに載せる
+# PRIMARY KEYを新しい方から辿るだけなので、ソートは発生しない
+SELECT_RECENT = f"""
+SELECT timestamp, size, used
+FROM {TABLE_NAME}
+ORDER BY timestamp DESC
+LIMIT ?
+"""
+
+
+class Ring:
+    """直近maxlen件のデータを保持するリングバッファ
+
+    カラムごとにnp.ndarrayを持ち、DBはプロセス再起動時の復元にだけ使う
+    """
+
+    def __init__(self, maxlen: int):
+        self.ts = np.zeros(maxlen, dtype=np.int64)
+        self.size = np.zeros(maxlen, dtype=np.int64)
+        self.used = np.zeros(maxlen, dtype=np.int64)
+        self.head = 0  # 次に書き込む位置
+        self.count = 0  # 保持している件数
+        self.version = 0  # pushされるたびに増える。キャッシュのキーに使う
+        # save_dataとdashのコールバックは別スレッドから触る
+        self._lock = threading.Lock()
+
+    def push(self, ts: int, size: int, used: int):
+        with self._lock:
+            self.ts[self.head] = ts
+            self.size[self.head] = size
+            self.used[self.head] = used
+            self.head = (self.head + 1) % len(self.ts)
+            self.count = min(self.count + 1, len(self.ts))
+            self.version += 1
+
+    def bulk_load(self, ts: np.ndarray, size: np.ndarray, used: np.ndarray):
+        """古い順に並んだ配列で中身を置き換える"""
+        n = min(len(ts), len(self.ts))
+        with self._lock:
+            self.ts[:n] = ts[len(ts) - n:]
+            self.size[:n] = size[len(ts) - n:]
+            self.used[:n] = used[len(ts) - n:]
+            self.head = n % len(self.ts)
+            self.count = n
+            self.version += 1
+
+    def _ordered(self, a: np.ndarray) -> np.ndarray:
+        if self.count < len(a):
+            return a[:self.count].copy()
+        # 一周しているときだけつなぎ直す
+        return np.concatenate((a[self.head:], a[:self.head]))
+
+    def snapshot(self) -> tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+        """versionと、古い順に並べた(ts, size, used)のコピー
+        versionと中身が食い違わないよう、同じロックの中で取り出す
+        """
+        with self._lock:
+            return (self.version, self._ordered(self.ts),
+                    self._ordered(self.size), self._ordered(self.used))
+
+
+RING = Ring(LIMIT_ROW)
+
+
+@dataclass(frozen=True)
+class DiskData:
+    """古い順に並んだカラムごとの配列"""
+    ts: np.ndarray  # UNIX timestamp
+    size: np.ndarray
+    used: np.ndarray
+    version: int = 0  # 取り出したときのRING.version
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def tail(self, n: int) -> "DiskData":
+        """直近n件"""
+        return DiskData(self.ts[-n:], self.size[-n:], self.used[-n:],
+                        self.version)
+
+    @property
+    def jst_ms(self) -> np.ndarray:
+        """グラフ表示用のAsia/Tokyoの時刻[ms]
+        xaxisをdate型にしておけば、plotlyは数値のまま日時として表示する
+        """
+        return (self.ts + JST_OFFSET_SEC) * 1000
 
 
 def db_init():
     """ DB初期設定 """
-    conn = sqlite3.connect(DB_NAME)
+    global _conn
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
     c = conn.cursor()
     c.execute(f'''
     CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+      -- rowidの別名になり、テーブル本体がtimestamp順のB-treeになる
+      -- 全カラムを持つので、これ以上のカバリングインデックスは不要
       timestamp INTEGER PRIMARY KEY,
       size INTEGER,
       used INTEGER
     )
     ''')
-    conn.close()
+    # コミットごとのfsyncを避ける
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA temp_store=MEMORY")
+    c.execute("PRAGMA mmap_size=268435456")  # 256MiB
+    _conn = conn
+
+    # 前回までのデータを起動時に1回のクエリでRINGに読み込み、
+    # 以降の読み込みはすべてメモリから行う
+    disk = read_db(conn)
+    RING.bulk_load(disk.ts, disk.size, disk.used)
+
+
+def db_close():
+    """DB終了処理
+    PRAGMA optimizeで必要な統計情報を更新してから閉じる
+    """
+    _conn.execute("PRAGMA optimize")
+    _conn.close()
+
+
+def read_db(conn: sqlite3.Connection) -> DiskData:
+    """DBから直近LIMIT_ROW件を古い順に読み込む
+    db_init()で開いた接続を使い回し、新たにファイルを開かない
+    停止していた期間があっても、RINGを過去のデータで埋められるよう
+    時刻ではなく件数で絞り込む
+    """
+    rows = conn.execute(SELECT_RECENT, (LIMIT_ROW, )).fetchall()
+    # 新しい順に取得したので、numpy上で反転して古い順にする
+    a = np.asarray(rows, dtype=np.int64).reshape(-1, 3)[::-1]
+    return DiskData(a[:, 0], a[:, 1], a[:, 2])
+
+
+def load_data() -> DiskData:
+    """RINGから直近LIMIT_ROW件を取り出す"""
+    version, ts, size, used = RING.snapshot()
+    return DiskData(ts, size, used, version)
+
+
+def insert_rows(rows: list[tuple[int, int, int]]):
+    """rowsを1トランザクションでINSERTする
+    時計が戻って同じtimestampが来ても、バッチ全体を失わないよう既存の行を残す
+    """
+    with _conn:
+        _conn.executemany(
+            f"INSERT OR IGNORE INTO {TABLE_NAME} VALUES (?,?,?)", rows)
 
 
-def load_data(db_path: str) -> pd.DataFrame:
+async def save_data(mount_path: str, interval: int):
+    try:
+        mount_path = await asyncio.to_thread(resolve_mount_point, mount_path)
+    except OSError:
+        log.exception("Cannot resolve %s, disk usage is not recorded",
+                      mount_path)
+        raise
+    rows = []
+    pending = None  # 別スレッドで書き込み中のINSERT
     try:
-        index_col = "timestamp"
-        conn = sqlite3.connect(db_path)
-        df = pd.read_sql_query(f"""
-                                SELECT * FROM (
-                                    SELECT *
-                                    FROM {TABLE_NAME}
-                                    ORDER BY {index_col} DESC
-                                    LIMIT {LIMIT_ROW}
-                                ) AS sub
-                                ORDER BY {index_col} ASC;
-                               """,
-                               conn,
-                               index_col=["timestamp"],
-                               parse_dates=["timestamp"])
-        df.index += datetime.timedelta(hours=9)  # Asia/Tokyo location
-        # timestamp化するときに強制的にUTC情報に変わっているため、loadしたときに
-        # 書き換える必要がある
-    except (sqlite3.DatabaseError, sqlite3.DataError) as e:
-        raise e
+        while True:
+            await asyncio.sleep(interval)
+            # ネットワークドライブのstatvfsやDBのfsyncでイベントループを
+            # 止めないよう、ブロックする処理は別スレッドで実行する
+            try:
+                data = await asyncio.to_thread(get_disk_space, mount_path)
+            except OSError:
+                # ネットワークドライブが一時的に見えなくなっても記録は止めない
+                log.exception("Failed to get disk space of %s", mount_path)
+                continue
+            log.debug("%s", data)
+            RING.push(*data)
+
+            rows.append(data)
+            if len(rows) < BATCH_ROW:
+                continue
+            # スレッドに渡した分はrowsから外し、キャンセルされても
+            # 書き込み中のINSERTは最後まで実行させる
+            batch, rows = rows, []
+            pending = asyncio.ensure_future(
+                asyncio.to_thread(insert_rows, batch))
+            try:
+                await asyncio.shield(pending)
+            except sqlite3.Error:
+                # DBに書き込めなくてもRINGへの記録は止めない
+                log.exception("Failed to save %d rows", len(batch))
+            pending = None
     finally:
-        conn.close()
-    return df
-
-
-async def save_data(mount_path: str, interval: int):
-    # global df
-    while True:
-        await asyncio.sleep(interval)
-        data = get_disk_space(mount_path)
-        print(data)
-
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
-        c.execute(f"INSERT INTO {TABLE_NAME} VALUES (?,?,?)", data)
-        conn.commit()
-        conn.close()
+        # 書き込み中のINSERTが終わるのを待ってから、
+        # 停止時に書き込み待ちのデータを残さない
+        if pending is not None:
+            try:
+                await pending
+            except sqlite3.Error:
+                log.exception("Failed to save rows")
+        if rows:
+            try:
+                insert_rows(rows)
+            except sqlite3.Error:
+                log.exception("Failed to save %d rows", len(rows))
+
+
+def resolve_mount_point(path: str) -> str:
+    """デバイスファイルが指定されたら、そのデバイスのマウント先を返す
+
+    dfコマンドと違いstatvfsはデバイスファイル自身(/dev)の容量を返すため
+    """
+    st = os.stat(path)
+    if not stat.S_ISBLK(st.st_mode):
+        return path
+    # ルートファイルシステムは/dev/rootのような別名で載っていることがあるので
+    # デバイス名ではなくmountinfoのmajor:minorで照合する
+    # (マウント先をstatすると、応答しないネットワークドライブで固まる)
+    device = f"{os.major(st.st_rdev)}:{os.minor(st.st_rdev)}"
+    with open("/proc/self/mountinfo") as f:
+        for line in f:
+            fields = line.split()
+            if fields[2] == device:
+                # 空白などは\040のように8進数でエスケープされている
+                return re.sub(r"\\([0-7]{3})",
+                              lambda m: chr(int(m.group(1), 8)), fields[4])
+    raise OSError(f"{path} is not mounted")
 
 
 def get_disk_space(mount_path) -> tuple[int, int, int]:
-    """dfコマンドを打ってDisk容量を取得する"""
-    output = subprocess.run(
-        [
-            "df",
-            "-k",  # 1KiB blocks 単位で取得
-            "--output=size,used",  # サイズと使用量のみ取得
-            mount_path,
-        ],
-        capture_output=True).stdout.decode()
-    stats = output.split("\n")[1].split()  # ヘッダーを省略
-
+    """statvfsでDisk容量を取得する"""
+    st = os.statvfs(mount_path)
     # UNIX timestampに変更
-    timestamp = int(datetime.datetime.now().timestamp())
     # datetime.fromtimestamp(timestamp) で人間が見やすい時刻に変換
-    # *1000してkB -> Byte表示
-    size = int(stats[0].replace(",", "")) * 1000
-    used = int(stats[1].replace(",", "")) * 1000
+    timestamp = int(time.time())
+    # Byte表示
+    size = st.f_blocks * st.f_frsize
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
     return (timestamp, size, used)
 
 
-def format_number(num):
-    """Define a function to format the numbers"""
-    suffixes = ['', 'k', 'M', 'G', 'T']
-    for suffix in suffixes:
-        if abs(num) < 1000:
-            return f"{num:.2f}{suffix}"
-        num /= 1000
+# グラフのlayoutのうち、コールバックごとに変わらない部分
+LAYOUT_TEMPLATE = {
+    "margin": {
+        "l": 45,
+        "r": 20,
+        "b": 30,
+        "t": 20,
+    },
+    "xaxis": {
+        # x軸はUNIX時間[ms]の数値で渡す
+        "type": "date",
+        "rangeslider": {
+            "visible": False
+        }
+    },
+    "yaxis": {
+        # "title": "size"
+    },
+    "legend": {
+        "orientation": "h",
+        "yanchor": "top",
+        "xanchor": "center",
+        "y": 1.1,
+        "x": 0.5,
+    }
+}
+
+SUFFIXES = ['', 'k', 'M', 'G', 'T']
+FREE_COLUMNS = ["size", "used", "free", "usage[%]"]
+
+
+def format_number(nums: np.ndarray) -> list:
+    """Define a function to format the numbers
+    配列をまとめて1000ごとの桁を求め、k, M, G, Tを付けた文字列にする
+    NaNはそのまま返す
+    """
+    vals = np.asarray(nums, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        exp = np.log10(np.abs(vals)) // 3
+    exp = np.clip(np.nan_to_num(exp, posinf=0, neginf=0), 0,
+                  len(SUFFIXES) - 1).astype(int)
+    scaled = vals / 1000.0**exp
+    return [
+        v if np.isnan(v) else f"{x:.2f}{SUFFIXES[e]}"
+        for v, x, e in zip(vals, scaled, exp)
+    ]
 
 
-def free_disk(df: pd.DataFrame) -> pd.DataFrame:
+def free_disk(disk: DiskData) -> list[dict]:
     """空き容量と使用率の表示"""
-    last = df.iloc[-1:]
-    last["free"] = last["size"] - last["used"]
-    last["usage[%]"] = last["used"] / last["size"] * 100
+    if not len(disk):
+        return []
+    size, used = int(disk.size[-1]), int(disk.used[-1])
+    values = [size, used, size - used, used / size * 100 if size else np.nan]
     # 小数以下2桁に整形して人が見やすいk, M, G, Tに変換
-    last = last.applymap(lambda x: format_number(x) if pd.notnull(x) else x)
-    return last
-
-
-def select_graph_type(df: pd.DataFrame,
-                      selected: str) -> (pd.DataFrame, list[go.Scatter]):
+    return [dict(zip(FREE_COLUMNS, format_number(values)))]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Bucketsで間引いたときに残すインデックス
+
+    先頭と末尾は必ず残し、間をn_out-2個のバケツに分けて
+    前後の点と作る三角形の面積が最大の点を1つずつ選ぶ
+    """
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    # msのUNIX時間とByteの積はint64に収まらないのでfloatで計算する
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    buckets = np.array_split(np.arange(1, n - 1), n_out - 2)
+    index = np.empty(n_out, dtype=np.int64)
+    index[0], index[-1] = 0, n - 1
+    a = 0
+    for i, bucket in enumerate(buckets):
+        nxt = buckets[i + 1] if i + 1 < len(buckets) else [n - 1]
+        avg_x, avg_y = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((x[a] - avg_x) * (y[bucket] - y[a]) -
+                      (x[a] - x[bucket]) * (avg_y - y[a]))
+        a = bucket[area.argmax()]
+        index[i + 1] = a
+    return index
+
+
+def downsample(x: np.ndarray, y: np.ndarray,
+               n_show: int) -> (np.ndarray, np.ndarray):
+    """直近n_show件はそのまま、それより古い分はDOWNSAMPLE_POINT件に間引く"""
+    n_old = max(len(x) - n_show, 0)
+    old = lttb(x[:n_old], y[:n_old], DOWNSAMPLE_POINT)
+    index = np.concatenate((old, np.arange(n_old, len(x))))
+    return x[index], y[index]
+
+
+def select_graph_type(disk: DiskData,
+                      selected: str,
+                      n_show: int = MAX_POINT) -> (DiskData, list[go.Scatter]):
+    # ブラウザに送るデータ量を減らすため、表示する直近n_show件以外は間引く
+    dff = disk.tail(n_show)
+    x = disk.jst_ms
+    size_x, size_y = downsample(x, disk.size, n_show)
     data = [go.Scatter(
-        x=df.index,
-        y=df["size"],
+        x=size_x,
+        y=size_y,
         name="size",
         mode="lines",
     )]
     if selected == "RealTime":
+        used_x, used_y = downsample(x, disk.used, n_show)
         data.append(
             go.Scatter(
-                x=df.index,
-                y=df["used"],
+                x=used_x,
+                y=used_y,
                 name="used",
                 fill="tozeroy",
                 mode="lines+markers",
             ))
-        return df, data
+        return dff, data
     elif selected == "Min-Max":
-        df["max"] = df.max()
-        df["min"] = df.min()
-        return df.loc[["size", "max", "min"]], data
+        # 使用量の最大・最小を水平線で表示
+        for name, y in (("max", disk.used.max()), ("min", disk.used.min())):
+            data.append(
+                go.Scatter(x=x[[0, -1]], y=[y, y], name=name, mode="lines"))
+        return dff, data
 
 
-def create_dash_app(df: pd.DataFrame,
+def relayout_range(relayout_data: dict, axis: str) -> Optional[list]:
+    """relayoutDataからaxisの表示範囲を取り出す
+    ズームでは"xaxis.range[0]", "xaxis.range[1]"のように分かれて届く
+    範囲が変えられていなければNone
+    """
+    keys = (f"{axis}.range[0]", f"{axis}.range[1]")
+    if all(key in relayout_data for key in keys):
+        return [relayout_data[key] for key in keys]
+    return relayout_data.get(f"{axis}.range")
+
+
+def create_dash_app(disk: DiskData,
                     requests_pathname_prefix: str = None) -> dash.Dash:
     """dash application run from main.py"""
     server = flask.Flask(__name__)
@@ -198,18 +476,81 @@ def create_dash_app(df: pd.DataFrame,
                          }],
                          value="RealTime"),
             dcc.Graph(id="my-graph"),
+            # このタブに最後に送ったグラフのRING.version
+            dcc.Store(id="graph-version"),
             dcc.Interval(
                 id="interval-component",
                 interval=INTERVAL_SEC * 1000,  # millisecを指定する
                 n_intervals=0),
             dash_table.DataTable(id="my-table",
-                                 data=free_disk(df).to_dict("records")),
+                                 data=free_disk(disk)),
             # input_div,
         ],
         className="container")
 
+    # (disk.version, グラフ種類) -> figure
+    figures = {}
+    figures_lock = threading.Lock()
+
+    def _figure(disk: DiskData, selected: str) -> dict:
+        """RINGの更新回数とグラフ種類をキーにキャッシュ
+        複数のタブから同じ更新回数でコールバックされても1回だけ計算する
+        """
+        key = (disk.version, selected)
+        # 同時に来たコールバックは先に来た方の計算結果を待つ
+        with figures_lock:
+            if key not in figures:
+                if len(figures) >= 4:  # 古いものから捨てる
+                    del figures[next(iter(figures))]
+                figures[key] = _build_figure(disk, selected)
+            return figures[key]
+
+    def _build_figure(disk: DiskData, selected: str) -> dict:
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("%s", disk.tail(10))
+        # ドロップダウンリストからグラフ種類の選択
+        dff, data = select_graph_type(disk, selected)
+
+        # 臨界値エリアの表示
+        # data.append(
+        #     go.Scatter(
+        #         x=dff.jst_ms,
+        #         y=[threshold] * len(dff),
+        #         name="臨界値",
+        #         fill="tozeroy",
+        #         mode="lines",
+        #         line_color=THRESHOLD_COLOR,
+        #         fillcolor=THRESHOLD_COLOR,
+        #     ))
+
+        # select_graph_typeで直近MAX_POINT件に絞り込み済み
+        show_range = (0, max(dff.size.max(), dff.used.max()) * 1.05)  # 上5%シフト
+        shift = INTERVAL_SEC * 1000  # interval分だけ左にシフト
+        x = dff.jst_ms
+
+        # 変化するのはxaxis, yaxisのrangeだけなので、それ以外はテンプレートを共有する
+        layout = copy.copy(LAYOUT_TEMPLATE)
+        layout["xaxis"] = {
+            **LAYOUT_TEMPLATE["xaxis"],
+            "range": (
+                # # 最大MAX_POINTポイントまで表示
+                x[-10] if len(dff) > 10 else x[0],
+                # # 1秒先まで表示
+                x[-1] + shift,
+            ),
+        }
+        layout["yaxis"] = {
+            **LAYOUT_TEMPLATE["yaxis"],
+            "range": show_range,
+        }
+
+        return {"data": data, "layout": layout}
+
     @app.callback(
-        Output("my-graph", "figure"),
+        [
+            Output("my-graph", "figure"),
+            Output("graph-version", "data"),
+        ],
         [
             # 表示方法の変更
             Input("my-dropdown", "value"),
@@ -221,6 +562,7 @@ def create_dash_app(df: pd.DataFrame,
             # State("my-graph", "figure"),
             Input("my-graph", "relayoutData"),
         ],
+        State("graph-version", "data"),
         prevent_initial_call=True,
     )
     def update_graph(
@@ -228,79 +570,47 @@ def create_dash_app(df: pd.DataFrame,
         n_intervals,
         # threshold: int,
         # current_figure,
-        relayout_data=[],
+        relayout_data=None,
+        sent_version=None,
     ):
-        df = load_data(DB_NAME)
-        print(df.iloc[-10:])
-        # ドロップダウンリストからグラフ種類の選択
-        dff, data = select_graph_type(df, selected_dropdown_value)
-
-        # 臨界値エリアの表示
-        # data.append(
-        #     go.Scatter(
-        #         x=dff.index,
-        #         y=[threshold] * len(dff),
-        #         name="臨界値",
-        #         fill="tozeroy",
-        #         mode="lines",
-        #         line_color=THRESHOLD_COLOR,
-        #         fillcolor=THRESHOLD_COLOR,
-        #     ))
-
-        show_df = dff[-100:]  # [-MAX_POINT:]
-        # (show_df.min().min(), show_df.max().max())
-        show_range = (0, show_df.max().max() * 1.05)  # 上5%シフト
-        shift = datetime.timedelta(seconds=INTERVAL_SEC)  # interval分だけ左にシフト
-
-        layout = {
-            "margin": {
-                "l": 45,
-                "r": 20,
-                "b": 30,
-                "t": 20,
-            },
-            "xaxis": {
-                "range": (
-                    # # 最大MAX_POINTポイントまで表示
-                    show_df.index[-10] if len(dff) > 10 else dff.index[0],
-                    # # 1秒先まで表示
-                    show_df.index[-1] + shift,
-                ),
-                "rangeslider": {
-                    "visible": False
-                }
-            },
-            "yaxis": {
-                "range": show_range,
-                # "title": "size"
-            },
-            "legend": {
-                "orientation": "h",
-                "yanchor": "top",
-                "xanchor": "center",
-                "y": 1.1,
-                "x": 0.5,
-            }
-        }
-
-        fig = {"data": data, "layout": layout}
-
-        # assert isinstance(relayout_data, list)
+        # ユーザーがグラフ尺度を変更していればその範囲
+        relayout_data = relayout_data or {}
+        xrange = relayout_range(relayout_data, "xaxis")
+        yrange = relayout_range(relayout_data, "yaxis")
+
+        # 表示範囲の変更だけならデータを読み直さず、layoutだけ書き換える
+        # ただしページを開いた直後のrelayoutData({"autosize": True})では
+        # まだグラフがないので、下で最初のグラフを作る
+        if ctx.triggered_id == "my-graph" and sent_version is not None:
+            if xrange is None and yrange is None:
+                return dash.no_update, dash.no_update
+            patch = Patch()
+            if xrange is not None:
+                patch["layout"]["xaxis"]["range"] = xrange
+            if yrange is not None:
+                patch["layout"]["yaxis"]["range"] = yrange
+            return patch, dash.no_update
+
+        # 前回の更新から新しいデータが来ていなければ何も送らない
+        disk = load_data()
+        version = disk.version
+        if (ctx.triggered_id == "interval-component"
+                and sent_version == version):
+            return dash.no_update, dash.no_update
+
+        # データが更新されていなければ前回のグラフを使い回す
+        fig = _figure(disk, selected_dropdown_value)
         # relayout_dataでrangeが変えられていなければ、デフォルトのlayoutで返す
-        items = [
-            "xaxis.range[0]", "xaxis.range[1]", "yaxis.range[0]",
-            "yaxis.range[1]"
-        ]
-        is_relayouted = any(item in relayout_data for item in items)
-        if not is_relayouted:
-            return fig
-
-        # TODO
-        # relayout_dataでrangeが変えられていれば、
+        if xrange is None and yrange is None:
+            return fig, version
+
         # ユーザーがグラフ尺度を変更したときにその状態をキープ
-        fig["layout"]["xaxis"]["range"] = relayout_data.get("xaxis.range")
-        fig["layout"]["yaxis"]["range"] = relayout_data.get("yaxis.range")
-        # (df.min().min(), df.max().max())
-        return fig
+        # figはキャッシュされているので書き換えずにコピーする
+        layout = copy.copy(fig["layout"])
+        if xrange is not None:
+            layout["xaxis"] = {**layout["xaxis"], "range": xrange}
+        if yrange is not None:
+            layout["yaxis"] = {**layout["yaxis"], "range": yrange}
+        return {"data": fig["data"], "layout": layout}, version
 
     return app
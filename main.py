@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 """
-Save the data to a SQLite3 database by periodically hitting the df command,
+Save the disk usage to a SQLite3 database by periodically calling statvfs,
 visualize the data using plotly-dash.
 
 Usage:
@@ -13,16 +13,18 @@ Open browser and access 'localhost:8881/index'
 """
 import os
 import asyncio
+import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.wsgi import WSGIMiddleware
 import uvicorn
 
-from dashapp import create_dash_app, db_init, load_data, \
-    save_data, INTERVAL_SEC, DB_NAME
+from dashapp import create_dash_app, db_init, db_close, load_data, \
+    save_data, INTERVAL_SEC
 
 VERSION = "v0.1.1r"
-app = FastAPI()
+log = logging.getLogger(__name__)
 
 # Check mount point for monitoring
 MNT_POINT = "/dev/mmcblk0p2"
@@ -30,6 +32,28 @@ if not os.path.exists(MNT_POINT):
     raise OSError(f"{MNT_POINT} not found")
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the sampler while the app is up, close the DB on shutdown"""
+    save_task = asyncio.create_task(save_data(MNT_POINT, INTERVAL_SEC))
+    try:
+        yield
+    finally:
+        # Flush buffered samples before closing the DB
+        save_task.cancel()
+        try:
+            await save_task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            log.exception("save_data stopped with an error")
+        finally:
+            db_close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
 @app.get("/")
 def read_main():
     return {
@@ -61,14 +85,12 @@ def get_status():
     return {"status": "ok"}
 
 
-# Create table if not exist
+# Create table if not exist, then restore recent data into memory
 db_init()
 
-df = load_data(DB_NAME)
-loop = asyncio.get_event_loop()
-loop.create_task(save_data(MNT_POINT, INTERVAL_SEC))
+disk = load_data()
 
-dash_app = create_dash_app(df, requests_pathname_prefix="/index/")
+dash_app = create_dash_app(disk, requests_pathname_prefix="/index/")
 app.mount("/index", WSGIMiddleware(dash_app.server))
 
 if __name__ == "__main__":